@@ -12,18 +12,47 @@
     4. Navigate to the folder that contains this script.
     5. Run the script by entering "python3 lol_basic_parser.py"
     6. Look in the folder for the output file.
+
+    Optionally, install orjson ("pip install orjson") to speed up reading
+    and writing JSON, such as the downloaded game files. To write a Parquet
+    file instead of a CSV, install pyarrow ("pip install pyarrow") and set
+    "output_format" in the CONFIG object to "parquet".
 """
 import json
 import requests
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
+import hashlib
+import os
+import re
 import sys
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 CONFIG = {
     "api_key": "",  # You can find your API key in the GRID dashboard
     "filename": "lol_data",  # Enter the name you want to use for the output file
     "include_date_in_file_name": True,  # True or False
+    "output_format": "csv",  # Options: "csv", "parquet" (requires pyarrow)
+    "max_concurrent_series": 8,  # Number of series to process at the same time
+    "max_concurrent_downloads": 16,  # Number of data files to download at the same time
+    "cache": True,  # True or False; reuse data from finished series downloaded in earlier runs
     "logging": "on"  # Options: "off", "on"
 }
 SERIES_IDS_TO_PULL = [
@@ -32,10 +61,11 @@ SERIES_IDS_TO_PULL = [
     # Example: "12345678", "23456789"
 ]
 
+# The series queries below are aliased by position so that several series can
+# be combined into a single GraphQL request; see build_series_batch_query
 SERIES_INFO_QUERY = """
-    {
-        series (
-            id: %s
+        series_%s: series (
+            id: $id_%s
         ) {
             id
             type
@@ -45,15 +75,14 @@ SERIES_INFO_QUERY = """
                 nameShortened
             }
         }
-    }
 """
 
 SERIES_STATE_QUERY = """
-    {
-        seriesState (
-            id: %s
+        series_state_%s: seriesState (
+            id: $id_%s
         ) {
             id
+            finished
             games {
                 id
                 sequenceNumber
@@ -61,9 +90,22 @@ SERIES_STATE_QUERY = """
                 finished
             }
         }
-    }
 """
 
+# Maximum number of series to combine into one GraphQL request, to stay
+# within the server's query complexity limits
+SERIES_PER_QUERY = 25
+
+# Number of rows to buffer before writing a row group to a Parquet output file
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# Folder, relative to where the script is run, used when CONFIG["cache"] is on
+CACHE_DIRECTORY = ".gridcache"
+
+# A team tag is up to 4 characters at the start of a summoner name, followed
+# by a space (e.g. "T1 Faker"); it must also be upper case, checked separately
+TEAM_TAG_PATTERN = re.compile(r"([^ ]{1,4}) (.*)", re.DOTALL)
+
 
 FIELD_LIST = [
     "platform_game_id",
@@ -108,13 +150,36 @@ FIELD_LIST = [
 ]
 
 
+class Query_Error(Exception):
+    """ Raised when GRID rejects a GraphQL query, either with a 4xx response
+        or with GraphQL errors, rather than the request failing in transit.
+    """
+
+
 class API_Messenger():
-    def __init__(self, api_key=None, log_to_terminal=None):
+    def __init__(self, api_key=None, log_to_terminal=None, pool_size=32):
         if not api_key:
             raise RuntimeError("No API key was provided")
-        self.headers = {
+        self.session = requests.Session()
+        self.session.headers.update({
             "x-api-key": api_key
-        }
+        })
+        # Timeouts, rate limiting and server errors are retried with
+        # exponential backoff by urllib3, honouring any Retry-After header.
+        # Once retries run out the last response is returned as-is.
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # Reuse TCP/TLS connections to the API across requests. The pool
+        # should hold at least as many connections as there are concurrent
+        # requests, or extra connections are closed after every use.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
         self.base_url = "https://api.grid.gg/"
         self.log_to_terminal = log_to_terminal
 
@@ -125,75 +190,86 @@ class API_Messenger():
             print_log_to_terminal("Making REST API call")
         request_url = f"{self.base_url}/{endpoint}"
 
-        try_count = 0
-        while True:
-            if try_count >= 5:
-                raise Exception("API request failed too many times")
-
-            try:
-                response = requests.get(request_url, headers=self.headers, timeout=3)
-            except requests.exceptions.Timeout:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request timed out; retrying")
-                try_count += 1
-                continue
-
-            if response.status_code == 200:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API call was successful")
-                return response.content
-            elif response.status_code == 429:
-                if self.log_to_terminal:
-                    print_log_to_terminal(f"API rate-limited; sleeping {response.headers.get('Retry-After')}s")
-                time.sleep(int(response.headers.get("Retry-After")))
-                try_count += 1
-                continue
-            elif response.status_code == 401:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request failed: request was not authorized (401 error)")
-                return response.status_code
-            elif response.status_code == 403:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request failed: access forbidden (403 error)")
-                return response.status_code
-            elif response.status_code == 404:
-                if self.log_to_terminal:
-                    print_log_to_terminal("Series not found (404 error)")
-                return response.status_code
-            else:
-                if self.log_to_terminal:
-                    print_log_to_terminal(f"API request failed: error code {response.status_code}; "
-                                          "sleeping and retrying")
-                time.sleep(1)
-                try_count += 1
-                continue
-
-    def post(self, query, endpoint="central-data/graphql"):
+        try:
+            response = self.session.get(request_url, timeout=3)
+        except requests.exceptions.RequestException as error:
+            raise Exception(f"API request failed too many times: {str(error)}")
+
+        if response.status_code == 200:
+            if self.log_to_terminal:
+                print_log_to_terminal("API call was successful")
+            return response.content
+        elif response.status_code == 401:
+            if self.log_to_terminal:
+                print_log_to_terminal("API request failed: request was not authorized (401 error)")
+            return response.status_code
+        elif response.status_code == 403:
+            if self.log_to_terminal:
+                print_log_to_terminal("API request failed: access forbidden (403 error)")
+            return response.status_code
+        elif response.status_code == 404:
+            if self.log_to_terminal:
+                print_log_to_terminal("Series not found (404 error)")
+            return response.status_code
+        else:
+            raise Exception(f"API request failed too many times: error code {response.status_code}")
+
+    def post(self, query, variables=None, endpoint="central-data/graphql"):
         """ Method to post a GraphQL request to GRID Central Data.
         """
         if self.log_to_terminal:
             print_log_to_terminal("Making GraphQL API call")
-        request_headers = self.headers
-        request_headers["Content-Type"] = "application/json"
-
-        payload = json.dumps({
+        payload = {
             "query": query
-        })
+        }
+        if variables:
+            payload["variables"] = variables
 
-        response = requests.request(
-            "POST",
-            f"{self.base_url}/{endpoint}",
-            headers=request_headers,
-            data=payload
-        )
+        try:
+            response = self.session.post(
+                f"{self.base_url}/{endpoint}",
+                headers={"Content-Type": "application/json"},
+                data=dump_json(payload)
+            )
+        except requests.exceptions.RequestException as error:
+            raise Exception(f"API request failed too many times: {str(error)}")
+
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise Query_Error(f"Query failed: error code {response.status_code}")
+        elif response.status_code != 200:
+            raise Exception(f"API request failed too many times: error code {response.status_code}")
 
-        if response.json().get("errors"):
-            raise Exception(f"Query failed: {response.json()['errors'][0]['message']}")
+        response_body = load_json(response.content)
+        if response_body.get("errors"):
+            raise Query_Error(f"Query failed: {response_body['errors'][0]['message']}")
 
-        response_body = response.json()
         return response_body
 
 
+class Parquet_Writer():
+    """ Writes rows to a Parquet file, buffering them into row groups.
+        Exposes the same writerows() method as csv.DictWriter.
+    """
+    def __init__(self, filename):
+        self.schema = build_parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression="zstd")
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
 def print_log_to_terminal(message):
     """ Simple command-line logger.
     """
@@ -201,29 +277,109 @@ def print_log_to_terminal(message):
     print(f"{timestamp} :: {message}")
 
 
+def load_json(raw_json):
+    """ Parse a JSON document, using orjson when it is installed.
+    """
+    if orjson:
+        return orjson.loads(raw_json)
+    return json.loads(raw_json)
+
+
+def dump_json(data):
+    """ Serialise data to JSON bytes, using orjson when it is installed.
+    """
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def read_cache(cache_key):
+    """ Return the cached content for cache_key, or None if caching is
+        turned off or nothing has been cached under that key yet.
+    """
+    if not CONFIG["cache"]:
+        return None
+    cache_path = os.path.join(CACHE_DIRECTORY, hashlib.sha1(cache_key.encode()).hexdigest())
+    try:
+        with open(cache_path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_cache(cache_key, content):
+    """ Store content (bytes) under cache_key, if caching is turned on.
+    """
+    if not CONFIG["cache"]:
+        return
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    cache_path = os.path.join(CACHE_DIRECTORY, hashlib.sha1(cache_key.encode()).hexdigest())
+    # Write to a temporary file first, so an interrupted run never leaves a
+    # partial entry behind
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIRECTORY, delete=False) as file:
+        file.write(content)
+    os.replace(file.name, cache_path)
+
+
 def split_team_tag_and_player_nickname(summoner_name, log_to_terminal=False):
     """ Attempts to split the team tag off of the summoner name.
     """
-    team_tag_found = False
     team_tag = None
     player_name = summoner_name
 
-    if summoner_name.find(" ") != -1 and summoner_name.find(" ") < 5:
-        start_of_summoner_name = summoner_name.split(" ")[0]
-        if start_of_summoner_name.isupper():
-            team_tag_found = True
-            team_tag = start_of_summoner_name
-            player_name = summoner_name[summoner_name.find(" ")+1:]
-            if log_to_terminal:
-                print(f"Split {summoner_name} into team tag {team_tag} and player name {player_name}")
-
-    if not team_tag_found:
+    match = TEAM_TAG_PATTERN.match(summoner_name)
+    if match and match.group(1).isupper():
+        team_tag, player_name = match.groups()
         if log_to_terminal:
-            print(f"Could not detect team tag in {summoner_name}")
+            print(f"Split {summoner_name} into team tag {team_tag} and player name {player_name}")
+    elif log_to_terminal:
+        print(f"Could not detect team tag in {summoner_name}")
 
     return team_tag, player_name
 
 
+def scan_timeline(timeline_file, team_totals):
+    """ Count the turret plates taken by each team and find the first blood
+        victim from the first ~14 minutes of the timeline.
+
+        :param: timeline_file, the raw Riot postgame details file
+        :param: team_totals, the per-team totals; turret_plates is incremented
+                in place
+        :returns: first_blood_victim, the participantId of the first blood
+                  victim, or None if none was found in that window
+    """
+    # Plate events carry the team that lost the plate; credit the other team
+    opposing_team = {100: 200, 200: 100}
+    first_blood_found = False
+    first_blood_victim = None
+    plates_total = 0
+    for frame in timeline_file["frames"]:
+        if frame["timestamp"] > 850000:
+            break
+        for event in frame["events"]:
+            event_type = event["type"]
+            if event_type == "TURRET_PLATE_DESTROYED":
+                team_id = opposing_team.get(event["teamId"])
+                if team_id is None:
+                    continue
+                team_totals[team_id]["turret_plates"] += 1
+                plates_total += 1
+            elif event_type == "CHAMPION_KILL":
+                if first_blood_found or event["killerId"] == 0:
+                    continue
+                first_blood_found = True
+                first_blood_victim = event["victimId"]
+            else:
+                continue
+
+            # Each side has 15 plates; once all are gone and first blood has
+            # happened, nothing else in the timeline is needed
+            if first_blood_found and plates_total >= 30:
+                return first_blood_victim
+
+    return first_blood_victim
+
+
 def game_factory(game_id, series_info, stats_file, timeline_file, live_data, log_to_terminal=False):
     """ Receive full data from the API call and prepare a cleaned array.
 
@@ -264,40 +420,32 @@ def game_factory(game_id, series_info, stats_file, timeline_file, live_data, log
         }
     }
 
-    first_blood_found = False
-    first_blood_victim = None
-    for frame in timeline_file["frames"]:
-        if frame["timestamp"] > 850000:
-            break
-        for event in frame["events"]:
-            if event["type"] == "TURRET_PLATE_DESTROYED":
-                if event["teamId"] == 200:
-                    team_id = 100
-                elif event["teamId"] == 100:
-                    team_id = 200
-                else:
-                    continue
-                team_totals[team_id]["turret_plates"] += 1
-
-            if event["type"] == "CHAMPION_KILL":
-                if first_blood_found:
-                    continue
-                if event["killerId"] != 0:
-                    first_blood_found = True
-                    first_blood_victim = event["victimId"]
+    first_blood_victim = scan_timeline(timeline_file, team_totals)
 
     for player in stats_file["participants"]:
-        team_totals[player["teamId"]]["kills"] += player["kills"]
-        team_totals[player["teamId"]]["deaths"] += player["deaths"]
-        team_totals[player["teamId"]]["gold_earned"] += player["goldEarned"]
-        team_totals[player["teamId"]]["creep_score"] += player["totalMinionsKilled"] + player["neutralMinionsKilled"]
-        team_totals[player["teamId"]]["damage_to_champions"] += player["totalDamageDealtToChampions"]
-        team_totals[player["teamId"]]["wards_placed"] += player["wardsPlaced"]
-        team_totals[player["teamId"]]["wards_killed"] += player["wardsKilled"]
-        team_totals[player["teamId"]]["control_wards_purchased"] += player["visionWardsBoughtInGame"]
+        player_team_totals = team_totals[player["teamId"]]
+        player_team_totals["kills"] += player["kills"]
+        player_team_totals["deaths"] += player["deaths"]
+        player_team_totals["gold_earned"] += player["goldEarned"]
+        player_team_totals["creep_score"] += player["totalMinionsKilled"] + player["neutralMinionsKilled"]
+        player_team_totals["damage_to_champions"] += player["totalDamageDealtToChampions"]
+        player_team_totals["wards_placed"] += player["wardsPlaced"]
+        player_team_totals["wards_killed"] += player["wardsKilled"]
+        player_team_totals["control_wards_purchased"] += player["visionWardsBoughtInGame"]
+
+    game_duration = stats_file["gameDuration"]
+    game_minutes = game_duration / 60
+
+    # The first team tag found among each side's players is used for the team row
+    team_tag_by_side = {}
 
     for player in stats_file["participants"]:
         team_tag, player_name = split_team_tag_and_player_nickname(player["riotIdGameName"], log_to_terminal)
+        if team_tag and player["teamId"] not in team_tag_by_side:
+            team_tag_by_side[player["teamId"]] = team_tag
+        player_team_totals = team_totals[player["teamId"]]
+        takedowns = player["kills"] + player["assists"]
+        creep_score = player["totalMinionsKilled"] + player["neutralMinionsKilled"]
 
         player_dto = {
             "platform_game_id": game_id,
@@ -309,46 +457,38 @@ def game_factory(game_id, series_info, stats_file, timeline_file, live_data, log
             "auto_detect_role": player["teamPosition"],  # NOTE: Riot's auto role detection may not be 100% reliable
             "champion": player["championName"],
             "win": int(player["win"]),
-            "game_duration": stats_file["gameDuration"],
+            "game_duration": game_duration,
             "kills": player["kills"],
             "deaths": player["deaths"],
             "assists": player["assists"],
-            "kda": (player["kills"] + player["assists"]) / (player["deaths"] if player["deaths"] > 0 else 1),
-            "kill_participation": (player["kills"] + player["assists"]) / team_totals[player["teamId"]]["kills"],
-            "team_kills": team_totals[player["teamId"]]["kills"],
-            "team_deaths": team_totals[player["teamId"]]["deaths"],
+            "kda": takedowns / (player["deaths"] if player["deaths"] > 0 else 1),
+            "kill_participation": takedowns / player_team_totals["kills"],
+            "team_kills": player_team_totals["kills"],
+            "team_deaths": player_team_totals["deaths"],
             "firstBloodKill": int(player["firstBloodKill"]),
             "firstBloodAssist": int(player["firstBloodAssist"]),
             "firstBloodVictim": 1 if player["participantId"] == first_blood_victim else 0,
-            "damagePerMinute": player["totalDamageDealtToChampions"] / (stats_file["gameDuration"]/60),
-            "damageShare": player["totalDamageDealtToChampions"] / team_totals[player["teamId"]]["damage_to_champions"],
-            "wardsPlacedPerMinute": player["wardsPlaced"] / (stats_file["gameDuration"]/60),
-            "wardsClearedPerMinute": player["wardsKilled"] / (stats_file["gameDuration"]/60),
+            "damagePerMinute": player["totalDamageDealtToChampions"] / game_minutes,
+            "damageShare": player["totalDamageDealtToChampions"] / player_team_totals["damage_to_champions"],
+            "wardsPlacedPerMinute": player["wardsPlaced"] / game_minutes,
+            "wardsClearedPerMinute": player["wardsKilled"] / game_minutes,
             "controlWardsPurchased": player["visionWardsBoughtInGame"],
-            "creepScore": player["totalMinionsKilled"] + player["neutralMinionsKilled"],
-            "creepScorePerMinute": (
-                (player["totalMinionsKilled"] + player["neutralMinionsKilled"])
-                /
-                (stats_file["gameDuration"]/60)
-            ),
+            "creepScore": creep_score,
+            "creepScorePerMinute": creep_score / game_minutes,
             "goldEarned": player["goldEarned"],
-            "goldEarnedPerMinute": player["goldEarned"] / (stats_file["gameDuration"]/60)
+            "goldEarnedPerMinute": player["goldEarned"] / game_minutes
         }
 
         cleaned_game_data.append(player_dto)
 
     for team in stats_file["teams"]:
-        team_tag = None
         team_id = team["teamId"]
-        for player in cleaned_game_data:
-            if player["side"] == team_id:
-                if player["team_tag"]:
-                    team_tag = player["team_tag"]
-                    if log_to_terminal:
-                        print(f"Found team tag {team_tag} for team {team_id}")
-                    break
-        if not team_tag:
-            if log_to_terminal:
+        side_team_totals = team_totals[team_id]
+        team_tag = team_tag_by_side.get(team_id)
+        if log_to_terminal:
+            if team_tag:
+                print(f"Found team tag {team_tag} for team {team_id}")
+            else:
                 print(f"Could not find a team tag for team {team_id}")
 
         team_dto = {
@@ -358,18 +498,18 @@ def game_factory(game_id, series_info, stats_file, timeline_file, live_data, log
             "team_tag": team_tag,
             "side": team_id,
             "win": int(team["win"]),
-            "gameDuration": stats_file["gameDuration"],
+            "gameDuration": game_duration,
             "teamKills": team["objectives"]["champion"]["kills"],
-            "teamDeaths": team_totals[team_id]["deaths"],
+            "teamDeaths": side_team_totals["deaths"],
             "firstBloodKill": int(team["objectives"]["champion"]["first"]),
-            "wardsPlacedPerMinute": team_totals[team_id]["wards_placed"] / (stats_file["gameDuration"]/60),
-            "wardsClearedPerMinute": team_totals[team_id]["wards_killed"] / (stats_file["gameDuration"]/60),
-            "controlWardsPurchased": team_totals[team_id]["control_wards_purchased"],
-            "creepScorePerMinute": team_totals[team_id]["creep_score"] / (stats_file["gameDuration"]/60),
-            "goldEarnedPerMinute": team_totals[team_id]["gold_earned"] / (stats_file["gameDuration"]/60),
+            "wardsPlacedPerMinute": side_team_totals["wards_placed"] / game_minutes,
+            "wardsClearedPerMinute": side_team_totals["wards_killed"] / game_minutes,
+            "controlWardsPurchased": side_team_totals["control_wards_purchased"],
+            "creepScorePerMinute": side_team_totals["creep_score"] / game_minutes,
+            "goldEarnedPerMinute": side_team_totals["gold_earned"] / game_minutes,
             "firstTurret": int(team["objectives"]["tower"]["first"]),
             "turretKills": team["objectives"]["tower"]["kills"],
-            "turretPlates": team_totals[team_id]["turret_plates"],
+            "turretPlates": side_team_totals["turret_plates"],
             "firstDragon": int(team["objectives"]["dragon"]["first"]),
             "dragonKills": team["objectives"]["dragon"]["kills"],
             "firstHerald": int(team["objectives"]["riftHerald"]["first"]),
@@ -384,30 +524,59 @@ def game_factory(game_id, series_info, stats_file, timeline_file, live_data, log
     return cleaned_game_data
 
 
-def main(log_to_terminal):
-    """ Main function.
+@lru_cache
+def build_series_batch_query(query_template, batch_size):
+    """ Combine one aliased copy of a series query per series into a single
+        GraphQL query, taking the series IDs as variables $id_0, $id_1, etc.
+
+        The query text only depends on the batch size, so it is built once
+        per size and the server sees the same document for every batch.
     """
-    start_time = datetime.now()
+    variable_definitions = ", ".join(f"$id_{index}: ID!" for index in range(batch_size))
+    selections = "".join(query_template % (index, index) for index in range(batch_size))
+    return f"query ({variable_definitions}) {{{selections}}}"
 
-    api = API_Messenger(
-        api_key=CONFIG["api_key"],
-        log_to_terminal=log_to_terminal
-    )
 
-    if len(SERIES_IDS_TO_PULL) < 1:
-        print("No series IDs were provided. Please edit the Python file and add series IDs where specified.")
-        sys.exit()
+def fetch_series_metadata(api, series_ids, log_to_terminal=False):
+    """ Fetch the basic metadata and the list of games for a batch of series,
+        using one GraphQL request per endpoint for the whole batch.
 
-    # Move forward with processing series
-    output_array = []
-
-    for series_id in SERIES_IDS_TO_PULL:
-        print_log_to_terminal(f"Starting series {series_id}")
-        # Get series info from Central Data
-        query = SERIES_INFO_QUERY % series_id
+        :param: api, the API_Messenger used for all requests
+        :param: series_ids, the GRID IDs of the series in the batch
+        :param: log_to_terminal, optional, whether or not to print detailed logs
+        :returns: batch_metadata, a dict of series_metadata keyed by series ID;
+                  series whose metadata could not be fetched are left out
+    """
+    info_query = build_series_batch_query(SERIES_INFO_QUERY, len(series_ids))
+    state_query = build_series_batch_query(SERIES_STATE_QUERY, len(series_ids))
+    variables = {f"id_{index}": series_id for index, series_id in enumerate(series_ids)}
+    try:
+        # Get series info from Central Data, and the list of individual games
+        # in each series from series state
+        info_response = api.post(info_query, variables=variables)
+        state_response = api.post(state_query, variables=variables, endpoint="live-data-feed/series-state/graphql")
+    except Query_Error as error:
+        if len(series_ids) == 1:
+            print_log_to_terminal(f"Could not fetch metadata for series {series_ids[0]}: {str(error)}")
+            return {}
+        # A single bad series fails the whole query, so fall back to one
+        # request per series to find out which ones can still be processed
+        if log_to_terminal:
+            print_log_to_terminal(f"Batched metadata query failed ({str(error)}); retrying series one at a time")
+        batch_metadata = {}
+        for series_id in series_ids:
+            batch_metadata.update(fetch_series_metadata(api, [series_id], log_to_terminal=log_to_terminal))
+        return batch_metadata
+    except Exception as error:
+        # Timeouts and server errors have already been retried, and sending
+        # one request per series would only add load to a struggling API
+        print_log_to_terminal(f"Could not fetch metadata for series {', '.join(series_ids)}: {str(error)}")
+        return {}
+
+    batch_metadata = {}
+    for index, series_id in enumerate(series_ids):
         try:
-            response = api.post(query)
-            series_from_central_data = response["data"]["series"]
+            series_from_central_data = info_response["data"][f"series_{index}"]
             if series_from_central_data["tournament"]["name"] == "League of Legends Scrims":
                 tournament_name = "Scrim"
             else:
@@ -420,64 +589,234 @@ def main(log_to_terminal):
                 "games": []
             }
 
-            # Now go to series state to get the list of individual games in the series
-            query = SERIES_STATE_QUERY % series_id
-            response = api.post(query, endpoint="live-data-feed/series-state/graphql")
+            series_state = state_response["data"][f"series_state_{index}"]
             if log_to_terminal:
-                print_log_to_terminal(f"Found {len(response['data']['seriesState']['games'])} "
-                                      f"games in series {series_id}")
-            for game in response["data"]["seriesState"]["games"]:
+                print_log_to_terminal(f"Found {len(series_state['games'])} games in series {series_id}")
+            for game in series_state["games"]:
                 series_metadata["games"].append(game)
         except Exception as error:
             print_log_to_terminal(f"Could not fetch metadata for series {series_id}: {str(error)}")
             continue
 
-        # This is where the download and parse for each game happens
-        for game in series_metadata["games"]:
-            # Fetch data files
-            sequence_number = game["sequenceNumber"]
-            stats_endpoint = f"file-download/end-state/riot/series/{series_id}/games/{sequence_number}/summary"
-            timeline_endpoint = f"file-download/end-state/riot/series/{series_id}/games/{sequence_number}/details"
-            live_endpoint = f"file-download/events/riot/series/{series_id}/games/{sequence_number}"
-
-            # Do downloads
-            stats_file = api.get(stats_endpoint)
-            timeline_file = api.get(timeline_endpoint)
-            live_file = api.get(live_endpoint)
-
-            # Convert responses into dict objects
-            stats_file = json.loads(stats_file)
-            timeline_file = json.loads(timeline_file)
-            live_data = live_file.decode(encoding="utf-8")
-
-            # Parse
-            game_id = f"{stats_file['platformId']}_{stats_file['gameId']}"
-            if log_to_terminal:
-                print_log_to_terminal(f"Sending game {game_id} to parser")
-            cleaned_game_data = game_factory(
-                game_id,
-                series_metadata,
-                stats_file,
-                timeline_file,
-                live_data,
-                log_to_terminal=log_to_terminal
-            )
+        # A finished series will not gain any more games, so it is safe to reuse
+        if series_state["finished"]:
+            write_cache(f"series-metadata/{series_id}", dump_json(series_metadata))
+
+        batch_metadata[series_id] = series_metadata
+
+    return batch_metadata
 
-            # Append results into output_array
-            output_array.extend(cleaned_game_data)
 
-        print_log_to_terminal(f"Finished parsing games in series {series_id}")
+def build_parquet_schema():
+    """ Build the typed Parquet schema for the columns in FIELD_LIST.
+    """
+    string = pyarrow.string()
+    integer = pyarrow.int32()
+    decimal = pyarrow.float32()
+    column_types = {
+        "platform_game_id": string,
+        "tournament_id": string,
+        "tournament_name": string,
+        "summoner_name": string,
+        "team_tag": string,
+        "side": integer,
+        "auto_detect_role": string,
+        "champion": string,
+        "win": integer,
+        "game_duration": integer,
+        "kills": integer,
+        "deaths": integer,
+        "assists": integer,
+        "kda": decimal,
+        "kill_participation": decimal,
+        "team_kills": integer,
+        "team_deaths": integer,
+        "firstBloodKill": integer,
+        "firstBloodAssist": integer,
+        "firstBloodVictim": integer,
+        "damagePerMinute": decimal,
+        "damageShare": decimal,
+        "wardsPlacedPerMinute": decimal,
+        "wardsClearedPerMinute": decimal,
+        "controlWardsPurchased": integer,
+        "creepScore": integer,
+        "creepScorePerMinute": decimal,
+        "goldEarned": integer,
+        "goldEarnedPerMinute": decimal,
+        "firstTurret": integer,
+        "turretKills": integer,
+        "turretPlates": integer,
+        "firstDragon": integer,
+        "dragonKills": integer,
+        "firstHerald": integer,
+        "riftHeraldKills": integer,
+        "baronKills": integer,
+        "inhibitorKills": integer,
+        "bans": pyarrow.list_(pyarrow.struct([("championId", integer), ("pickTurn", integer)]))
+    }
+    return pyarrow.schema([(field, column_types[field]) for field in FIELD_LIST])
+
+
+@contextmanager
+def open_output_writer(filename):
+    """ Open the output file in the format set in CONFIG["output_format"].
+
+        :param: filename, the output file name without an extension
+        :yields: output_writer, an object with a writerows() method that
+                 accepts the cleaned row dicts
+    """
+    if CONFIG["output_format"] == "parquet":
+        output_writer = Parquet_Writer(f"{filename}.parquet")
+        try:
+            yield output_writer
+        finally:
+            output_writer.close()
+    else:
+        with open(f"{filename}.csv", "w", newline="") as file:
+            csv_writer = csv.DictWriter(file, fieldnames=FIELD_LIST, extrasaction="ignore")
+            csv_writer.writeheader()
+            yield csv_writer
+
+
+def fetch_game_file(api, endpoint, use_cache=False):
+    """ Download a game data file, reusing a cached copy when allowed.
+
+        :param: api, the API_Messenger used for all requests
+        :param: endpoint, the file-download endpoint of the file
+        :param: use_cache, optional, whether the file is final and may be
+                read from and written to the cache
+        :returns: the file content, or the error status code from the API
+    """
+    if use_cache:
+        cached_content = read_cache(endpoint)
+        if cached_content is not None:
+            return cached_content
+
+    content = api.get(endpoint)
+    if use_cache and isinstance(content, bytes):
+        write_cache(endpoint, content)
+    return content
+
+
+def process_series(api, series_metadata, download_pool, log_to_terminal=False):
+    """ Download and parse every game in a single series.
+
+        :param: api, the API_Messenger used for all requests
+        :param: series_metadata, the basic metadata for the series, including
+                its list of games
+        :param: download_pool, the executor used to download game data files
+        :param: log_to_terminal, optional, whether or not to print detailed logs
+        :returns: series_output, an array of cleaned rows for every game in
+                  the series
+    """
+    series_id = series_metadata["series_id"]
+    print_log_to_terminal(f"Starting series {series_id}")
+
+    # Start the downloads for every game in the series at once, so the
+    # data files are fetched concurrently rather than one after another
+    game_downloads = []
+    for game in series_metadata["games"]:
+        sequence_number = game["sequenceNumber"]
+        stats_endpoint = f"file-download/end-state/riot/series/{series_id}/games/{sequence_number}/summary"
+        timeline_endpoint = f"file-download/end-state/riot/series/{series_id}/games/{sequence_number}/details"
+        live_endpoint = f"file-download/events/riot/series/{series_id}/games/{sequence_number}"
+        # Files of a finished game never change, so they can be cached
+        use_cache = game["finished"]
+        game_downloads.append((
+            download_pool.submit(fetch_game_file, api, stats_endpoint, use_cache),
+            download_pool.submit(fetch_game_file, api, timeline_endpoint, use_cache),
+            download_pool.submit(fetch_game_file, api, live_endpoint, use_cache)
+        ))
+
+    # This is where the parse for each game happens, in series order
+    series_output = []
+    for stats_download, timeline_download, live_download in game_downloads:
+        # Wait for the data files
+        stats_file = stats_download.result()
+        timeline_file = timeline_download.result()
+        live_file = live_download.result()
+
+        # Convert responses into dict objects
+        stats_file = load_json(stats_file)
+        timeline_file = load_json(timeline_file)
+        live_data = live_file.decode(encoding="utf-8")
+
+        # Parse
+        game_id = f"{stats_file['platformId']}_{stats_file['gameId']}"
+        if log_to_terminal:
+            print_log_to_terminal(f"Sending game {game_id} to parser")
+        cleaned_game_data = game_factory(
+            game_id,
+            series_metadata,
+            stats_file,
+            timeline_file,
+            live_data,
+            log_to_terminal=log_to_terminal
+        )
+
+        # Append results into series_output
+        series_output.extend(cleaned_game_data)
+
+    print_log_to_terminal(f"Finished parsing games in series {series_id}")
+    return series_output
+
+
+def main(log_to_terminal):
+    """ Main function.
+    """
+    start_time = datetime.now()
+
+    api = API_Messenger(
+        api_key=CONFIG["api_key"],
+        log_to_terminal=log_to_terminal,
+        pool_size=CONFIG["max_concurrent_downloads"] + CONFIG["max_concurrent_series"]
+    )
+
+    if len(SERIES_IDS_TO_PULL) < 1:
+        print("No series IDs were provided. Please edit the Python file and add series IDs where specified.")
+        sys.exit()
+
+    if CONFIG["output_format"] == "parquet" and not pyarrow:
+        print("Writing Parquet files requires pyarrow. Install it with \"pip install pyarrow\", "
+              "or set output_format to \"csv\".")
+        sys.exit()
+
+    # Move forward with processing series. Metadata is fetched in batches
+    # first; series are then independent of each other, so several are
+    # processed at once. Rows are written to the output as each series is done,
+    # in the order the series IDs were provided.
+    all_series_metadata = {}
+    series_ids_to_fetch = []
+    for series_id in SERIES_IDS_TO_PULL:
+        cached_metadata = read_cache(f"series-metadata/{series_id}")
+        if cached_metadata is not None:
+            all_series_metadata[series_id] = load_json(cached_metadata)
+        else:
+            series_ids_to_fetch.append(series_id)
+
+    for batch_start in range(0, len(series_ids_to_fetch), SERIES_PER_QUERY):
+        batch_series_ids = series_ids_to_fetch[batch_start:batch_start + SERIES_PER_QUERY]
+        all_series_metadata.update(fetch_series_metadata(api, batch_series_ids, log_to_terminal=log_to_terminal))
 
-    # Dump the output_array to a CSV and save to disk
     date_string = f"_{datetime.now().strftime('%Y%m%d_%H%M') if CONFIG['include_date_in_file_name'] else ''}"
-    filename_to_use = f"{CONFIG['filename']}{date_string}.csv"
-    with open(filename_to_use, "w", newline="") as file:
-        csv_writer = csv.writer(file, delimiter=',')
-        csv_writer.writerow(FIELD_LIST)
-        for row in output_array:
-            csv_writer.writerow([
-                row.get(field) for field in FIELD_LIST
-            ])
+    filename_to_use = f"{CONFIG['filename']}{date_string}"
+    with open_output_writer(filename_to_use) as output_writer:
+        with ThreadPoolExecutor(max_workers=CONFIG["max_concurrent_downloads"]) as download_pool, \
+                ThreadPoolExecutor(max_workers=CONFIG["max_concurrent_series"]) as series_pool:
+            # Only max_concurrent_series jobs are queued at a time, and each
+            # job is dropped as soon as its rows are written, so finished
+            # series are never all held in memory at once
+            series_jobs = deque()
+            for series_id in SERIES_IDS_TO_PULL:
+                if series_id not in all_series_metadata:
+                    continue
+                series_jobs.append(series_pool.submit(
+                    process_series, api, all_series_metadata[series_id], download_pool, log_to_terminal
+                ))
+                if len(series_jobs) >= CONFIG["max_concurrent_series"]:
+                    output_writer.writerows(series_jobs.popleft().result())
+            while series_jobs:
+                output_writer.writerows(series_jobs.popleft().result())
 
     runtime = str(datetime.now() - start_time).split(".")[0]
     print(f"Zug zug; job's done :: Runtime: {runtime}")
@@ -12,20 +12,48 @@
     4. Navigate to the folder that contains this script.
     5. Run the script by entering "python3 val_basic_parser.py"
     6. Look in the folder for the output file.
+
+    Optionally, install orjson ("pip install orjson") to speed up reading
+    and writing JSON, such as the downloaded match history.
 """
 import json
+import logging
+import random
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import BytesIO
+from functools import lru_cache
+from operator import itemgetter
 from zipfile import ZipFile
+import os
+import shutil
 import sys
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+    # ijson is slower than loading the whole document at once, even with its
+    # compiled backend, so it is only used to save memory when orjson is not
+    # installed, and never with the much slower pure-Python backend
+    if orjson or ijson.backend not in ("yajl2_c", "yajl2_cffi"):
+        ijson = None
+except ImportError:
+    ijson = None
 
 CONFIG = {
     "api_key": "",  # You can find your API key in the GRID dashboard
     "filename": "valorant_data",  # Enter the name you want to use for the output file
     "include_date_in_file_name": True,  # True or False
+    "max_concurrent_series": 8,  # Number of series to process at the same time
     "logging": "on"  # Options: "off", "on"
 }
 SERIES_IDS_TO_PULL = [
@@ -35,9 +63,8 @@ SERIES_IDS_TO_PULL = [
 ]
 
 SERIES_INFO_QUERY = """
-    {
-        series (
-            id: %s
+        series_%s: series (
+            id: $id_%s
         ) {
             id
             type
@@ -47,101 +74,297 @@ SERIES_INFO_QUERY = """
                 nameShortened
             }
         }
-    }
 """
 
+# Number of series whose metadata is requested in a single GraphQL query
+SERIES_PER_QUERY = 25
+
+COLUMNS = [
+    "game_id",
+    "series_id",
+    "tournament_id",
+    "tournament_name",
+    "map_id",
+    "map_name",
+    "game_start",
+    "game_version",
+    "game_number",
+    "player_name",
+    "team_id",
+    "team_name",
+    "agent_id",
+    "agent_name",
+    "win",
+    "roundsWon",
+    "roundsLost",
+    "attackRoundsWon",
+    "attackRoundsLost",
+    "defenseRoundsWon",
+    "defenseRoundsLost",
+    "kills",
+    "deaths",
+    "assists",
+    "averageCombatScore",
+    "damagePerRound",
+    "first_kills",
+    "first_deaths",
+    "headshot_rate"
+]
+
+
+# Map and agent metadata from valorant-api.com rarely changes, so it is kept
+# on disk and only downloaded again once it is older than the TTL (seconds)
+METADATA_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "val_basic_parser")
+METADATA_CACHE_TTL = 24 * 60 * 60
+RIOT_ZIP_SPOOL_SIZE = 16 << 20  # Bytes of a Riot zip kept in memory before spilling to a temporary file
+
+logger = logging.getLogger("val_basic_parser")
+
+# Keyed on (attacking side, whether the attackers won the round); each entry names the
+# two team counters that round increments
+ROUND_OUTCOME_INCREMENTS = {
+    ("Blue", True): ("Blue", "attackWins", "Red", "defenseLosses"),
+    ("Blue", False): ("Blue", "attackLosses", "Red", "defenseWins"),
+    ("Red", True): ("Red", "attackWins", "Blue", "defenseLosses"),
+    ("Red", False): ("Red", "attackLosses", "Blue", "defenseWins"),
+}
+
+
+class Query_Error(Exception):
+    """ Raised when GRID rejects a GraphQL query, either with a 4xx response
+        or with GraphQL errors, rather than the request failing in transit.
+    """
+
 
 class API_Messenger():
-    def __init__(self, api_key=None, log_to_terminal=None):
+    def __init__(self, api_key=None):
         if not api_key:
             raise RuntimeError("No API key was provided")
-        self.headers = {
+        self.session = requests.Session()
+        self.session.headers.update({
             "x-api-key": api_key
-        }
+        })
+        # Reuse TCP/TLS connections to the API across requests
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self.session.mount("https://", adapter)
         self.base_url = "https://api.grid.gg/"
-        self.log_to_terminal = log_to_terminal
+        # Retry settings: failed requests are retried up to max_retries times,
+        # waiting exponentially longer (with random jitter) between attempts
+        self.max_retries = 5
+        self.backoff_base = 1.0
+        self.backoff_cap = 30
+        self.backoff_jitter = 0.5
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.session.close()
+
+    def _sleep_backoff(self, attempt, reason, minimum=0):
+        """ Sleep before retrying a failed request, using exponential backoff
+            with jitter so that retries do not pile onto a struggling server.
+        """
+        delay = min(
+            self.backoff_cap,
+            self.backoff_base * (2 ** attempt) * (1 + random.random() * self.backoff_jitter)
+        )
+        delay = max(minimum, delay)
+        logger.debug("%s; sleeping %.1fs and retrying", reason, delay)
+        time.sleep(delay)
+
+    def _request_with_retry(self, method, url, **kwargs):
+        """ Send a request through the session, retrying timeouts, rate
+            limiting and unexpected errors with backoff.
+
+            :returns: response, for a 200 or for a 401/403/404 error, which
+                      retrying would not fix
+        """
+        for try_count in range(self.max_retries):
+            minimum = 0
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.Timeout:
+                reason = "API request timed out"
+            else:
+                if response.status_code in (200, 401, 403, 404):
+                    return response
+
+                # Release the connection of a streamed response before retrying
+                response.close()
+                if response.status_code == 429:
+                    reason = "API rate-limited"
+                    # Never retry sooner than the server asked us to
+                    minimum = int(response.headers.get("Retry-After", 0))
+                else:
+                    reason = f"API request failed: error code {response.status_code}"
+
+            # Don't wait after the last attempt; there is nothing left to retry
+            if try_count + 1 >= self.max_retries:
+                break
+            self._sleep_backoff(try_count, reason, minimum=minimum)
+
+        raise Exception("API request failed too many times")
 
     def get(self, series_id, endpoint="file-download/end-state/riot/series"):
         """ Send get request to Riot API.
         """
-        if self.log_to_terminal:
-            print_log_to_terminal("Making REST API call")
+        logger.debug("Making REST API call")
         request_url = f"{self.base_url}/{endpoint}/{series_id}"
 
-        try_count = 0
-        while True:
-            if try_count >= 5:
-                raise Exception("API request failed too many times")
+        response = self._request_with_retry("GET", request_url, timeout=3)
 
-            try:
-                response = requests.get(request_url, headers=self.headers, timeout=3)
-            except requests.exceptions.Timeout:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request timed out; retrying")
-                try_count += 1
-                continue
-
-            if response.status_code == 200:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API call was successful")
-                return response.content
-            elif response.status_code == 429:
-                if self.log_to_terminal:
-                    print_log_to_terminal(f"API rate-limited; sleeping {response.headers.get('Retry-After')}s")
-                time.sleep(int(response.headers.get("Retry-After")))
-                try_count += 1
-                continue
-            elif response.status_code == 401:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request failed: request was not authorized (401 error)")
-                return response.status_code
-            elif response.status_code == 403:
-                if self.log_to_terminal:
-                    print_log_to_terminal("API request failed: access forbidden (403 error)")
-                return response.status_code
-            elif response.status_code == 404:
-                if self.log_to_terminal:
-                    print_log_to_terminal(f"Series with ID {series_id} was not found (404 error)")
+        if response.status_code == 200:
+            logger.debug("API call was successful")
+            return response.content
+        self._log_failed_status(response.status_code, series_id)
+        return response.status_code
+
+    def download(self, series_id, file, endpoint="file-download/end-state/riot/series"):
+        """ Stream a file download into an open file object, so large files
+            never have to be held in memory in full.
+
+            :param: series_id, the GRID ID of the series
+            :param: file, a writable binary file object
+            :returns: file, positioned at the start, or the status code of a
+                      401/403/404 error
+        """
+        logger.debug("Making REST API download call")
+        request_url = f"{self.base_url}/{endpoint}/{series_id}"
+
+        with self._request_with_retry("GET", request_url, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                self._log_failed_status(response.status_code, series_id)
                 return response.status_code
-            else:
-                if self.log_to_terminal:
-                    print_log_to_terminal(f"API request failed: error code {response.status_code}; "
-                                          "sleeping and retrying")
-                time.sleep(1)
-                try_count += 1
-                continue
-
-    def post(self, query):
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, file)
+
+        logger.debug("API download was successful")
+        file.seek(0)
+        return file
+
+    def _log_failed_status(self, status_code, series_id):
+        """ Log why a 401/403/404 response failed.
+        """
+        if status_code == 401:
+            logger.debug("API request failed: request was not authorized (401 error)")
+        elif status_code == 403:
+            logger.debug("API request failed: access forbidden (403 error)")
+        elif status_code == 404:
+            logger.debug("Series with ID %s was not found (404 error)", series_id)
+
+    def post(self, query, variables=None):
         """ Method to post a GraphQL request to GRID Central Data.
         """
-        if self.log_to_terminal:
-            print_log_to_terminal("Making GraphQL API call")
-        request_headers = self.headers
-        request_headers["Content-Type"] = "application/json"
-
-        payload = json.dumps({
+        logger.debug("Making GraphQL API call")
+        payload = {
             "query": query
-        })
+        }
+        if variables:
+            payload["variables"] = variables
 
-        response = requests.request(
+        response = self._request_with_retry(
             "POST",
             f"{self.base_url}/central-data/graphql",
-            headers=request_headers,
-            data=payload
+            headers={"Content-Type": "application/json"},
+            data=dump_json(payload),
+            timeout=10
         )
+        if response.status_code != 200:
+            raise Query_Error(f"Query failed: error code {response.status_code}")
 
-        if response.json().get("errors"):
-            raise Exception(f"Query failed: {response.json()['errors'][0]['message']}")
+        response_body = load_json(response.content)
+        if response_body.get("errors"):
+            raise Query_Error(f"Query failed: {response_body['errors'][0]['message']}")
 
-        response_body = response.json()
         return response_body
 
 
-def print_log_to_terminal(message):
-    """ Simple command-line logger.
+class Player_Stats():
+    """ Counters for one player, aggregated across the rounds of a game.
+        Slots keep the per-round increments cheap attribute updates.
+    """
+    __slots__ = ("total_damage", "headshots", "bodyshots", "legshots", "first_kills", "first_deaths")
+
+    def __init__(self):
+        self.total_damage = 0
+        self.headshots = 0
+        self.bodyshots = 0
+        self.legshots = 0
+        self.first_kills = 0
+        self.first_deaths = 0
+
+
+def configure_logging(level):
+    """ Print this script's log messages to the terminal with a timestamp.
+
+        :param: level, the lowest logging level to print
+    """
+    logging.basicConfig(format="%(asctime)s :: %(message)s")
+    logger.setLevel(level)
+
+
+def load_json(raw_json):
+    """ Parse a JSON document, using orjson when it is installed.
+    """
+    if orjson:
+        return orjson.loads(raw_json)
+    return json.loads(raw_json)
+
+
+def dump_json(data):
+    """ Serialise data to JSON bytes, using orjson when it is installed.
     """
-    timestamp = datetime.now()
-    print(f"{timestamp} :: {message}")
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def iter_json_array(file):
+    """ Read the items of a top-level JSON array from a binary file. Uses
+        orjson when it is installed, as it is the fastest; otherwise streams
+        the items one at a time with ijson if it is available.
+
+        :param: file, a binary file object containing a JSON array
+        :returns: an iterable of the array's items
+    """
+    if ijson:
+        return ijson.items(file, "item", use_float=True)
+    return load_json(file.read())
+
+
+def load_cached_json(session, url, cache_path, ttl_seconds=METADATA_CACHE_TTL):
+    """ Fetch and decode a JSON document, reusing a copy saved on disk if it
+        is younger than ttl_seconds.
+
+        :param: session, the requests session used if the document is downloaded
+        :param: url, the URL of the JSON document
+        :param: cache_path, the file the document is cached in
+        :param: ttl_seconds, optional, how long a cached copy stays valid
+        :returns: the decoded JSON document
+    """
+    try:
+        if time.time() - os.path.getmtime(cache_path) < ttl_seconds:
+            with open(cache_path, "rb") as file:
+                return load_json(file.read())
+    except (OSError, ValueError):
+        # Missing, unreadable or corrupt cache; download a fresh copy
+        pass
+
+    response = session.get(url)
+    content = load_json(response.content)
+    if response.status_code == 200:
+        # Write to a temporary file first, so an interrupted run never
+        # leaves a partial cache file behind. The cache is only a speed-up,
+        # so a folder that cannot be written to is not an error.
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), delete=False) as file:
+                file.write(response.content)
+            os.replace(file.name, cache_path)
+        except OSError as error:
+            logger.debug("Could not cache %s at %s: %s", url, cache_path, error)
+    return content
 
 
 def game_metadata_factory(game_data_from_grid_endstate):
@@ -180,13 +403,13 @@ def game_metadata_factory(game_data_from_grid_endstate):
     return metadata
 
 
-def game_factory(raw_game_data, series_metadata, val_metadata, log_to_terminal=False):
+def game_factory(raw_game_data, series_metadata, val_metadata):
     """ Receive full data from the API call and prepare a cleaned array.
 
         :param: raw_game_data, the raw Riot postgame data
         :param: series_metadata, a dict containing precleaned basic metadata
                 from the series
-        :returns: cleaned_game_data, an array of 12 dicts containing calculated
+        :returns: cleaned_game_data, an array of 12 tuples containing calculated
                   stats from the game for the 10 participating players and the
                   2 participating teams
     """
@@ -196,20 +419,13 @@ def game_factory(raw_game_data, series_metadata, val_metadata, log_to_terminal=F
     game_start = datetime.fromtimestamp(raw_game_data["matchInfo"]["gameStartMillis"] / 1000)
 
     # Clean up game version (patch) string to make it more readable
-    start_simple_gm_ver = raw_game_data["matchInfo"]["gameVersion"].find("-") + 1
-    end_simple_gm_vr = raw_game_data["matchInfo"]["gameVersion"].find("-", start_simple_gm_ver + 1)
-    game_version_clean = float(raw_game_data["matchInfo"]["gameVersion"][start_simple_gm_ver:end_simple_gm_vr])
-
-    match_found = False
-    for game_metadata in series_metadata["games"]:
-        if game_metadata["map_name"] == map_name:
-            if log_to_terminal:
-                print_log_to_terminal(f"Matched game {game_id} on map name ({map_name})")
-            match_found = True
-            this_game_metadata = game_metadata
-            break
-    if not match_found:
+    # e.g. "release-08.05-shipping-6-2500000" becomes 8.05
+    game_version_clean = float(raw_game_data["matchInfo"]["gameVersion"].split("-", 2)[1])
+
+    this_game_metadata = series_metadata["games_by_map"].get(map_name)
+    if this_game_metadata is None:
         raise ValueError("Unable to match game to metadata")
+    logger.debug("Matched game %s on map name (%s)", game_id, map_name)
 
     # Match team info from GRID end-state to teams in Riot game data
     team_side_refs = {
@@ -218,12 +434,10 @@ def game_factory(raw_game_data, series_metadata, val_metadata, log_to_terminal=F
     }
     for team in raw_game_data["teams"]:
         if team["roundsWon"] == this_game_metadata["team_one"]["rounds_won"]:
-            if log_to_terminal:
-                print_log_to_terminal(f"Team {team['teamId']} is team_one")
+            logger.debug("Team %s is team_one", team["teamId"])
             team_side_refs[team["teamId"]] = "team_one"
         elif team["roundsWon"] == this_game_metadata["team_two"]["rounds_won"]:
-            if log_to_terminal:
-                print_log_to_terminal(f"Team {team['teamId']} is team_two")
+            logger.debug("Team %s is team_two", team["teamId"])
             team_side_refs[team["teamId"]] = "team_two"
         else:
             raise ValueError(f"Failed to map {team['teamId']} onto a team from "
@@ -248,304 +462,340 @@ def game_factory(raw_game_data, series_metadata, val_metadata, log_to_terminal=F
 
     for idx, round_data in enumerate(raw_game_data["roundResults"]):
         round_number = idx + 1
-        if round_number < 25:
-            attackers = "Red" if round_number < 13 else "Blue"
-        else:
-            attackers = "Red" if round_number % 2 == 1 else "Blue"
-
-        if attackers == "Blue":
-            if round_data["winningTeam"] == "Blue":
-                team_preaggregated_stats["Blue"]["attackWins"] += 1
-                team_preaggregated_stats["Red"]["defenseLosses"] += 1
-            else:
-                team_preaggregated_stats["Blue"]["attackLosses"] += 1
-                team_preaggregated_stats["Red"]["defenseWins"] += 1
-        elif attackers == "Red":
-            if round_data["winningTeam"] == "Red":
-                team_preaggregated_stats["Red"]["attackWins"] += 1
-                team_preaggregated_stats["Blue"]["defenseLosses"] += 1
-            else:
-                team_preaggregated_stats["Red"]["attackLosses"] += 1
-                team_preaggregated_stats["Blue"]["defenseWins"] += 1
+        attackers = "Red" if round_number < 13 or (round_number >= 25 and round_number % 2 == 1) else "Blue"
+        attacking_side, attacking_outcome, defending_side, defending_outcome = ROUND_OUTCOME_INCREMENTS[
+            (attackers, round_data["winningTeam"] == attackers)
+        ]
+        team_preaggregated_stats[attacking_side][attacking_outcome] += 1
+        team_preaggregated_stats[defending_side][defending_outcome] += 1
 
         round_kill_events = []
         # Upon encountering a player, check if their PUUID is in player_preaggregated_stats
-        # and add them if it isn't. Then increment values into their dict.
+        # and add them if it isn't. Then increment their counters.
         for player in round_data["playerStats"]:
-            if not player_preaggregated_stats.get(player["puuid"]):
-                player_preaggregated_stats[player["puuid"]] = {
-                    "total_damage": 0,
-                    "headshots": 0,
-                    "bodyshots": 0,
-                    "legshots": 0,
-                    "first_kills": 0,
-                    "first_deaths": 0
-                }
+            player_stats = player_preaggregated_stats.get(player["puuid"])
+            if player_stats is None:
+                player_stats = Player_Stats()
+                player_preaggregated_stats[player["puuid"]] = player_stats
 
             for target in player["damage"]:
-                player_preaggregated_stats[player["puuid"]]["total_damage"] += target["damage"]
-                player_preaggregated_stats[player["puuid"]]["headshots"] += target["headshots"]
-                player_preaggregated_stats[player["puuid"]]["bodyshots"] += target["bodyshots"]
-                player_preaggregated_stats[player["puuid"]]["legshots"] += target["legshots"]
+                player_stats.total_damage += target["damage"]
+                player_stats.headshots += target["headshots"]
+                player_stats.bodyshots += target["bodyshots"]
+                player_stats.legshots += target["legshots"]
 
             for kill in player["kills"]:
                 round_kill_events.append(kill)
 
-        # Now sort the array of kills and store the first kill / death PUUIDs
-        sorted_kills = sorted(
+        # Now find the earliest kill and store the first kill / death PUUIDs
+        if not round_kill_events:
+            continue
+        first_kill = min(
             round_kill_events,
             key=lambda kill: kill["timeSinceRoundStartMillis"]
         )
 
-        player_preaggregated_stats[sorted_kills[0]["killer"]]["first_kills"] += 1
-        player_preaggregated_stats[sorted_kills[0]["victim"]]["first_deaths"] += 1
-
-    # Start generating output data
+        player_preaggregated_stats[first_kill["killer"]].first_kills += 1
+        player_preaggregated_stats[first_kill["victim"]].first_deaths += 1
+
+    # Start generating output data. Rows are tuples in COLUMNS order, and
+    # every row starts with the same game-level columns.
+    game_columns = (
+        game_id,
+        series_metadata["series_id"],
+        series_metadata["tournament_id"],
+        series_metadata["tournament_name"],
+        map_id,
+        map_name,
+        game_start,
+        game_version_clean,
+        this_game_metadata["game_number"]
+    )
     cleaned_game_data = []
-    team_rows_added_map = {
-        "Blue_team_row_added": False,
-        "Red_team_row_added": False
-    }
 
-    # Create the 5 players and 1 team row for each team
-    player_count_found = 0
+    # Group the players by team, dropping Neutral (observer) players
+    players_by_team = {
+        "Blue": [],
+        "Red": []
+    }
     for player in raw_game_data["players"]:
-        if player["teamId"] == "Neutral":
-            continue
+        if player["teamId"] != "Neutral":
+            players_by_team[player["teamId"]].append(player)
+    if len(players_by_team["Blue"]) + len(players_by_team["Red"]) < 10:
+        raise ValueError("Found fewer than 10 non-Neutral players")
 
-        player_count_found += 1
-        player_id = player["puuid"]
-        rounds_won = this_game_metadata[team_side_refs[player["teamId"]]]["rounds_won"]
-        player_row = {
-            "game_id": game_id,
-            "series_id": series_metadata["series_id"],
-            "tournament_id": series_metadata["tournament_id"],
-            "tournament_name": series_metadata["tournament_name"],
-            "map_id": map_id,
-            "map_name": map_name,
-            "game_start": game_start,
-            "game_version": game_version_clean,
-            "game_number": this_game_metadata["game_number"],
-            "player_name": player["gameName"],
-            "team_id": this_game_metadata[team_side_refs[player["teamId"]]]["id"],
-            "team_name": this_game_metadata[team_side_refs[player["teamId"]]]["name"],
-            "agent_id": player["characterId"],
-            "agent_name": val_metadata["agents"][player["characterId"]]["displayName"],
-            "win": 1 if this_game_metadata[team_side_refs[player["teamId"]]]["winner"] else 0,
-            "roundsWon": rounds_won,
-            "roundsLost": player["stats"]["roundsPlayed"] - rounds_won,
-            "attackRoundsWon": team_preaggregated_stats[player["teamId"]]["attackWins"],
-            "attackRoundsLost": team_preaggregated_stats[player["teamId"]]["attackLosses"],
-            "defenseRoundsWon": team_preaggregated_stats[player["teamId"]]["defenseWins"],
-            "defenseRoundsLost": team_preaggregated_stats[player["teamId"]]["defenseLosses"],
-            "kills": player["stats"]["kills"],
-            "deaths": player["stats"]["deaths"],
-            "assists": player["stats"]["assists"],
-            "averageCombatScore": round(player["stats"]["score"] / player["stats"]["roundsPlayed"], 1),
-            "damagePerRound": round(
-                player_preaggregated_stats[player_id]["total_damage"]
-                /
-                player["stats"]["roundsPlayed"],
-                1
-            ),
-            "first_kills": player_preaggregated_stats[player_id]["first_kills"],
-            "first_deaths": player_preaggregated_stats[player_id]["first_deaths"],
-            "headshot_rate": round((
-                player_preaggregated_stats[player_id]["headshots"]
-                /
-                (
-                    player_preaggregated_stats[player_id]["headshots"]
-                    + player_preaggregated_stats[player_id]["bodyshots"]
-                    + player_preaggregated_stats[player_id]["legshots"]
-                )
-            ), 3)
-        }
-        cleaned_game_data.append(player_row)
-
-        # If there is no Team row for this team yet, construct one
-        if not team_rows_added_map[f"{player['teamId']}_team_row_added"]:
-            if log_to_terminal:
-                print_log_to_terminal(f"Adding row for {player['teamId']} team")
-            # Null strings are added in some places to ensure the CSV-write is
-            # clean, by forcing the correct number of columns
-            team_row = {
-                "game_id": game_id,
-                "series_id": series_metadata["series_id"],
-                "tournament_id": series_metadata["tournament_id"],
-                "tournament_name": series_metadata["tournament_name"],
-                "map_id": map_id,
-                "map_name": map_name,
-                "game_start": game_start,
-                "game_version": game_version_clean,
-                "game_number": this_game_metadata["game_number"],
-                "player_name": "",
-                "team_id": this_game_metadata[team_side_refs[player["teamId"]]]["id"],
-                "team_name": this_game_metadata[team_side_refs[player["teamId"]]]["name"],
-                "agent_id": "",
-                "agent_name": "",
-                "win": 1 if this_game_metadata[team_side_refs[player["teamId"]]]["winner"] else 0,
-                "roundsWon": rounds_won,
-                "roundsLost": player["stats"]["roundsPlayed"] - rounds_won,
-                "attackRoundsWon": team_preaggregated_stats[player["teamId"]]["attackWins"],
-                "attackRoundsLost": team_preaggregated_stats[player["teamId"]]["attackLosses"],
-                "defenseRoundsWon": team_preaggregated_stats[player["teamId"]]["defenseWins"],
-                "defenseRoundsLost": team_preaggregated_stats[player["teamId"]]["defenseLosses"],
-                "kills": "",
-                "deaths": "",
-                "assists": "",
-                "averageCombatScore": "",
-                "damagePerRound": "",
-                "first_kills": "",
-                "first_deaths": "",
-                "headshot_rate": ""
-            }
-            cleaned_game_data.append(team_row)
-            team_rows_added_map[f"{player['teamId']}_team_row_added"] = True
+    # Create the 5 player rows, sorted by name, and then 1 team row for each team
+    for team_id, team_players in players_by_team.items():
+        if not team_players:
+            raise ValueError(f"Failed to create a team row for {team_id} team")
+        team_metadata = this_game_metadata[team_side_refs[team_id]]
+        team_stats = team_preaggregated_stats[team_id]
+        rounds_won = team_metadata["rounds_won"]
+
+        for player in sorted(team_players, key=itemgetter("gameName")):
+            stats = player["stats"]
+            player_stats = player_preaggregated_stats[player["puuid"]]
+            rounds_played = stats["roundsPlayed"]
+            player_row = game_columns + (
+                player["gameName"],
+                team_metadata["id"],
+                team_metadata["name"],
+                player["characterId"],
+                val_metadata["agents"][player["characterId"]]["displayName"],
+                1 if team_metadata["winner"] else 0,
+                rounds_won,
+                rounds_played - rounds_won,
+                team_stats["attackWins"],
+                team_stats["attackLosses"],
+                team_stats["defenseWins"],
+                team_stats["defenseLosses"],
+                stats["kills"],
+                stats["deaths"],
+                stats["assists"],
+                round(stats["score"] / rounds_played, 1),
+                round(player_stats.total_damage / rounds_played, 1),
+                player_stats.first_kills,
+                player_stats.first_deaths,
+                round((
+                    player_stats.headshots
+                    /
+                    (player_stats.headshots + player_stats.bodyshots + player_stats.legshots)
+                ), 3)
+            )
+            cleaned_game_data.append(player_row)
+
+        logger.debug("Adding row for %s team", team_id)
+        rounds_played = team_players[0]["stats"]["roundsPlayed"]
+        # Null strings are added in some places to ensure the CSV-write is
+        # clean, by forcing the correct number of columns
+        team_row = game_columns + (
+            "",
+            team_metadata["id"],
+            team_metadata["name"],
+            "",
+            "",
+            1 if team_metadata["winner"] else 0,
+            rounds_won,
+            rounds_played - rounds_won,
+            team_stats["attackWins"],
+            team_stats["attackLosses"],
+            team_stats["defenseWins"],
+            team_stats["defenseLosses"],
+            "",
+            "",
+            "",
+            "",
+            "",
+            "",
+            "",
+            ""
+        )
+        cleaned_game_data.append(team_row)
 
-    if player_count_found < 10:
-        raise ValueError("Found fewer than 10 non-Neutral players")
-    if not team_rows_added_map["Blue_team_row_added"]:
-        raise ValueError("Failed to create a team row for Blue team")
-    if not team_rows_added_map["Red_team_row_added"]:
-        raise ValueError("Failed to create a team row for Red team")
-
-    sorted_cleaned_game_data = sorted(
-        cleaned_game_data,
-        key=lambda row: (row["player_name"] == "", row["player_name"], row["team_name"])
-    )
+    return cleaned_game_data
 
-    return sorted_cleaned_game_data
 
+@lru_cache(maxsize=None)
+def build_series_batch_query(batch_size):
+    """ Combine one aliased copy of SERIES_INFO_QUERY per series into a single
+        GraphQL query, taking the series IDs as variables $id_0, $id_1, etc.
 
-def main(log_to_terminal):
-    """ Main function.
+        The query text only depends on the batch size, so it is built once
+        per size and the server sees the same document for every batch.
     """
-    start_time = datetime.now()
+    variable_definitions = ", ".join(f"$id_{index}: ID!" for index in range(batch_size))
+    selections = "".join(SERIES_INFO_QUERY % (index, index) for index in range(batch_size))
+    return f"query ({variable_definitions}) {{{selections}}}"
 
-    api = API_Messenger(
-        api_key=CONFIG["api_key"],
-        log_to_terminal=log_to_terminal
-    )
 
-    if len(SERIES_IDS_TO_PULL) < 1:
-        print("No series IDs were provided. Please edit the Python file and add series IDs where specified.")
-        sys.exit()
-
-    # Get some Valornat metadata from the community resource valorant-api.com
-    if log_to_terminal:
-        print_log_to_terminal("Fetching map and agent metadata from valorant-api.com")
-    maps_response = requests.get("https://valorant-api.com/v1/maps")
-    maps_response = json.loads(maps_response.content)
-    map_metadata = {}
-    for map in maps_response["data"]:
-        map_metadata[map["mapUrl"]] = map
-
-    agents_response = requests.get("https://valorant-api.com/v1/agents")
-    agents_response = json.loads(agents_response.content)
-    agent_metadata = {}
-    for agent in agents_response["data"]:
-        agent_metadata[agent["uuid"]] = agent
-
-    val_metadata = {
-        "maps": map_metadata,
-        "agents": agent_metadata
-    }
-
-    # Move forward with processing series
-    output_array = []
+def fetch_series_metadata(api, series_ids):
+    """ Fetch the basic metadata for a batch of series from Central Data,
+        using one GraphQL request for the whole batch.
 
-    for series_id in SERIES_IDS_TO_PULL:
-        print_log_to_terminal(f"Starting series {series_id}")
-        # Get series info from Central Data
-        query = SERIES_INFO_QUERY % series_id
+        :param: api, the API_Messenger used for all GRID requests
+        :param: series_ids, the GRID IDs of the series in the batch
+        :returns: batch_metadata, a dict of series_metadata keyed by series ID;
+                  series whose metadata could not be fetched are left out
+    """
+    variables = {f"id_{index}": series_id for index, series_id in enumerate(series_ids)}
+    try:
+        response = api.post(build_series_batch_query(len(series_ids)), variables=variables)
+    except Query_Error as error:
+        if len(series_ids) == 1:
+            logger.warning("Could not fetch metadata for series %s: %s", series_ids[0], error)
+            return {}
+        # A single bad series fails the whole query, so fall back to one
+        # request per series to find out which ones can still be processed
+        logger.debug("Batched metadata query failed (%s); retrying series one at a time", error)
+        batch_metadata = {}
+        for series_id in series_ids:
+            batch_metadata.update(fetch_series_metadata(api, [series_id]))
+        return batch_metadata
+    except Exception as error:
+        # Timeouts and server errors have already been retried, and sending
+        # one request per series would only add load to a struggling API
+        logger.warning("Could not fetch metadata for series %s: %s", ", ".join(series_ids), error)
+        return {}
+
+    batch_metadata = {}
+    for index, series_id in enumerate(series_ids):
         try:
-            response = api.post(query)
-            series_from_central_data = response["data"]["series"]
-            series_metadata = {
+            series_from_central_data = response["data"][f"series_{index}"]
+            batch_metadata[series_id] = {
                 "series_id": series_id,
                 "tournament_id": series_from_central_data["tournament"]["id"],
                 "tournament_name": series_from_central_data["tournament"]["name"],
-                "games": []
+                "games": [],
+                "games_by_map": {}
             }
         except Exception as error:
-            print_log_to_terminal(f"Could not fetch metadata for series {series_id}: {str(error)}")
-            continue
+            logger.warning("Could not fetch metadata for series %s: %s", series_id, error)
+
+    return batch_metadata
+
+
+def process_series(api, series_metadata, val_metadata):
+    """ Download and parse every game in a single series.
+
+        :param: api, the API_Messenger used for all GRID requests
+        :param: series_metadata, the series' metadata from fetch_series_metadata
+        :param: val_metadata, the map and agent metadata from valorant-api.com
+        :returns: series_output, an array of cleaned rows for every game in
+                  the series, or None if the series could not be fetched
+    """
+    series_id = series_metadata["series_id"]
+    logger.info("Starting series %s", series_id)
+
+    # Get GRID end-state data
+    grid_endstate_endpoint = "file-download/end-state/grid/series"
+    try:
+        grid_endstate_response = api.get(series_id, endpoint=grid_endstate_endpoint)
+    except Exception as error:
+        logger.warning("Could not fetch GRID end-state data for series %s: %s", series_id, error)
+        return None
+    if not isinstance(grid_endstate_response, bytes):
+        logger.warning(
+            "Could not fetch GRID end-state data for series %s: error code %s", series_id, grid_endstate_response
+        )
+        return None
+    grid_series_endstate = load_json(grid_endstate_response)
 
-        # Get GRID end-state data
-        grid_endstate_endpoint = "file-download/end-state/grid/series"
+    for game_grid_endstate in grid_series_endstate["games"]:
         try:
-            grid_endstate_response = api.get(series_id, endpoint=grid_endstate_endpoint)
+            game_id = game_grid_endstate["id"]
+            game_metadata = game_metadata_factory(game_grid_endstate)
+            series_metadata["games"].append(game_metadata)
+            series_metadata["games_by_map"].setdefault(game_metadata["map_name"], game_metadata)
         except Exception as error:
-            print_log_to_terminal(f"Could not fetch GRID end-state data for series {series_id}: {str(error)}")
-            continue
-        grid_series_endstate = json.loads(grid_endstate_response)
+            logger.warning("Could not parse game %s from series %s: %s", game_id, series_id, error)
+        continue
+
+    # Get Riot match history data
+    # The zip is spooled to disk once it outgrows RIOT_ZIP_SPOOL_SIZE, so
+    # large series are never held in memory as raw bytes. Each game is parsed
+    # as soon as it has been read, so when the games are streamed only one is
+    # in memory at a time.
+    with tempfile.SpooledTemporaryFile(max_size=RIOT_ZIP_SPOOL_SIZE) as riot_zip:
+        try:
+            riot_download = api.download(series_id, riot_zip)
+        except Exception as error:
+            logger.warning("Could not fetch Riot match history for series %s: %s", series_id, error)
+            return None
+        if riot_download is not riot_zip:
+            logger.warning("Could not fetch Riot match history for series %s: error code %s", series_id, riot_download)
+            return None
+        with ZipFile(riot_zip) as zip_file, zip_file.open(zip_file.namelist()[0]) as extracted_file:
+            series_output = []
+            game_count = 0
+            for game_data in iter_json_array(extracted_file):
+                game_count += 1
+                logger.debug("Sending game %s to parser", game_data["matchInfo"]["matchId"])
+                series_output.extend(game_factory(game_data, series_metadata, val_metadata))
+
+    logger.info("Finished parsing %s games in series %s", game_count, series_id)
+    return series_output
+
+
+def main():
+    """ Main function.
+    """
+    start_time = datetime.now()
 
-        for game_grid_endstate in grid_series_endstate["games"]:
-            try:
-                game_id = game_grid_endstate["id"]
-                game_metadata = game_metadata_factory(game_grid_endstate)
-                series_metadata["games"].append(game_metadata)
-            except Exception as error:
-                print_log_to_terminal(f"Could not parse game {game_id} from series {series_id}: {str(error)}")
-            continue
+    api = API_Messenger(api_key=CONFIG["api_key"])
+
+    with api, requests.Session() as metadata_session, \
+            ThreadPoolExecutor(max_workers=CONFIG["max_concurrent_series"]) as series_pool:
+        if len(SERIES_IDS_TO_PULL) < 1:
+            print("No series IDs were provided. Please edit the Python file and add series IDs where specified.")
+            sys.exit()
+
+        # Get some Valornat metadata from the community resource valorant-api.com.
+        # This uses its own session so the GRID API key is never sent there.
+        logger.debug("Fetching map and agent metadata from valorant-api.com")
+        maps_download = series_pool.submit(
+            load_cached_json,
+            metadata_session,
+            "https://valorant-api.com/v1/maps",
+            os.path.join(METADATA_CACHE_DIRECTORY, "maps.json")
+        )
+        agents_download = series_pool.submit(
+            load_cached_json,
+            metadata_session,
+            "https://valorant-api.com/v1/agents",
+            os.path.join(METADATA_CACHE_DIRECTORY, "agents.json")
+        )
+        maps_response = maps_download.result()
+        map_metadata = {}
+        for map in maps_response["data"]:
+            map_metadata[map["mapUrl"]] = map
+
+        agents_response = agents_download.result()
+        agent_metadata = {}
+        for agent in agents_response["data"]:
+            agent_metadata[agent["uuid"]] = agent
+
+        val_metadata = {
+            "maps": map_metadata,
+            "agents": agent_metadata
+        }
 
-        # Get Riot match history data
-        response = api.get(series_id)
-        zip_file = ZipFile(BytesIO(response))
-        extracted_file = zip_file.open(zip_file.namelist()[0]).readlines()
-        series_data = json.loads(extracted_file[0])
-        if log_to_terminal:
-            print_log_to_terminal(f"Series {series_id} contains {len(series_data)} games")
-
-        for game_data in series_data:
-            game_id = game_data["matchInfo"]["matchId"]
-            if log_to_terminal:
-                print_log_to_terminal(f"Sending game {game_id} to parser")
-            cleaned_game_data = game_factory(game_data, series_metadata, val_metadata, log_to_terminal=log_to_terminal)
-
-            # Append results into output_array
-            output_array.extend(cleaned_game_data)
-
-        print_log_to_terminal(f"Finished parsing {len(series_data)} games in series {series_id}")
-
-    # Dump the output_array to a CSV and save to disk
-    date_string = f"_{datetime.now().strftime('%Y%m%d_%H%M') if CONFIG['include_date_in_file_name'] else ''}"
-    filename_to_use = f"{CONFIG['filename']}{date_string}.csv"
-    with open(filename_to_use, "w", newline="") as file:
-        csv_writer = csv.writer(file, delimiter=',')
-        csv_writer.writerow([
-            "game_id",
-            "series_id",
-            "tournament_id",
-            "tournament_name",
-            "map_id",
-            "map_name",
-            "game_start",
-            "game_version",
-            "game_number",
-            "player_name",
-            "team_id",
-            "team_name",
-            "agent_id",
-            "agent_name",
-            "win",
-            "roundsWon",
-            "roundsLost",
-            "attackRoundsWon",
-            "attackRoundsLost",
-            "defenseRoundsWon",
-            "defenseRoundsLost",
-            "kills",
-            "deaths",
-            "assists",
-            "averageCombatScore",
-            "damagePerRound",
-            "first_kills",
-            "first_deaths",
-            "headshot_rate"
-        ])
-        for row in output_array:
-            csv_writer.writerow(row.values())
+        # Move forward with processing series. Metadata is fetched in batches
+        # first; series are then independent of each other, so several are
+        # processed at once. Rows are written to the CSV as each series is
+        # done, in the order the series IDs were provided, so partial results
+        # survive a crash mid-run.
+        all_series_metadata = {}
+        for batch_start in range(0, len(SERIES_IDS_TO_PULL), SERIES_PER_QUERY):
+            batch_series_ids = SERIES_IDS_TO_PULL[batch_start:batch_start + SERIES_PER_QUERY]
+            all_series_metadata.update(fetch_series_metadata(api, batch_series_ids))
+
+        date_string = f"_{start_time.strftime('%Y%m%d_%H%M') if CONFIG['include_date_in_file_name'] else ''}"
+        filename_to_use = f"{CONFIG['filename']}{date_string}.csv"
+        with open(filename_to_use, "w", newline="", buffering=1 << 20) as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(COLUMNS)
+
+            # Only max_concurrent_series jobs are queued at a time, and each
+            # job is dropped as soon as its rows are written, so finished
+            # series are never all held in memory at once
+            series_jobs = deque()
+
+            def write_next_series():
+                series_output = series_jobs.popleft().result()
+                if series_output:
+                    csv_writer.writerows(series_output)
+                    file.flush()
+
+            for series_id in SERIES_IDS_TO_PULL:
+                if series_id not in all_series_metadata:
+                    continue
+                series_jobs.append(
+                    series_pool.submit(process_series, api, all_series_metadata[series_id], val_metadata)
+                )
+                if len(series_jobs) >= CONFIG["max_concurrent_series"]:
+                    write_next_series()
+            while series_jobs:
+                write_next_series()
 
     runtime = str(datetime.now() - start_time).split(".")[0]
     print(f"Zug zug; job's done :: Runtime: {runtime}")
@@ -555,8 +805,8 @@ if __name__ == "__main__":
     print("Starting the GRID Valorant flat-file generator")
     if bool(CONFIG["logging"] == "on"):
         print("Detailed logging to terminal enabled")
-        log_to_terminal = True
+        configure_logging(logging.DEBUG)
     else:
-        log_to_terminal = False
+        configure_logging(logging.INFO)
 
-    main(log_to_terminal)
+    main()